@@ -5,6 +5,7 @@ import io
 import pytz
 import calendar
 from datetime import datetime
+from hours import compute_work_hours, compute_hours_fields
 
 # ==========================================
 # 1. Database Initialization (MongoDB)
@@ -15,6 +16,24 @@ def init_connection():
 
 client = init_connection()
 db = client['kinihara_timesheet']
+
+# Baseline payroll rule: 30-day month, PT 200 (300 in February), OT at ₹50/hour.
+# "*" in role/branch matches every employee; more specific rows win.
+DEFAULT_PAYROLL_RULE = {
+    "version": 1,
+    "role": "*",
+    "branch": "*",
+    "effective_from": "2024-01-01",
+    "salary_basis": "fixed",
+    "fixed_days": 30.0,
+    "pt_amount": 200.0,
+    "pt_override_month": "February",
+    "pt_override_amount": 300.0,
+    "ot_rate": 50.0
+}
+PAYROLL_RULE_FIELDS = list(DEFAULT_PAYROLL_RULE.keys())
+PAYROLL_NUMERIC_FIELDS = ["fixed_days", "pt_amount", "pt_override_amount", "ot_rate"]
+
 def init_db():
     users_coll = db['users']
     if users_coll.count_documents({}) == 0:
@@ -26,12 +45,21 @@ def init_db():
             {"name": "Abhishek", "pin": "4444", "role": "staff", "monthly_salary": 18000.0, "working_days": 26, "standard_hours": 8.0, "security_deposit": 0.0}
         ]
         users_coll.insert_many(initial_users)
+    if db.payroll_rules.count_documents({}) == 0:
+        db.payroll_rules.insert_one(dict(DEFAULT_PAYROLL_RULE))
+    # Replay and snapshot lookups filter by month and order by seq
+    db.attendance_events.create_index([("month_val", 1), ("year_val", 1), ("seq", 1)])
+    db.attendance_snapshots.create_index([("month_val", 1), ("year_val", 1), ("seq", 1)])
 
 init_db()
 
 def get_users():
-    cursor = db.users.find({}, {"_id": 0, "name": 1, "pin": 1, "role": 1, "monthly_salary": 1, "working_days": 1, "standard_hours": 1, "security_deposit": 1})
+    cursor = db.users.find({}, {"_id": 0, "name": 1, "pin": 1, "role": 1, "branch": 1, "monthly_salary": 1, "working_days": 1, "standard_hours": 1, "security_deposit": 1})
     df = pd.DataFrame(list(cursor))
+    if not df.empty:
+        if 'branch' not in df.columns:
+            df['branch'] = ""
+        df['branch'] = df['branch'].fillna("")
     return df
 
 def get_staff_names():
@@ -44,6 +72,356 @@ def check_pin(name, pin):
         return True, user.get("role")
     return False, None
 
+def get_payroll_rule_versions():
+    return sorted(db.payroll_rules.distinct("version"), reverse=True)
+
+def next_payroll_rule_version():
+    # Start the counter at the highest existing version, then allocate atomically
+    versions = get_payroll_rule_versions()
+    db.counters.update_one({"_id": "payroll_rules"}, {"$max": {"seq": versions[0] if versions else 0}}, upsert=True)
+    counter = db.counters.find_one_and_update(
+        {"_id": "payroll_rules"},
+        {"$inc": {"seq": 1}},
+        return_document=pymongo.ReturnDocument.AFTER
+    )
+    return counter["seq"]
+
+def validate_payroll_rules(rules_df):
+    errors = []
+    for i, row in enumerate(rules_df.to_dict("records"), start=1):
+        effective_from = str(row.get("effective_from", "")).strip()
+        try:
+            valid_date = datetime.strptime(effective_from, "%Y-%m-%d").strftime("%Y-%m-%d") == effective_from
+        except:
+            valid_date = False
+        if not valid_date:
+            errors.append(f"Row {i}: Effective From must be a date in YYYY-MM-DD format.")
+        fixed_days = pd.to_numeric(row.get("fixed_days"), errors='coerce')
+        if pd.isna(fixed_days) or fixed_days <= 0:
+            errors.append(f"Row {i}: Fixed Days must be greater than 0.")
+        if row.get("salary_basis") not in ("fixed", "working_days"):
+            errors.append(f"Row {i}: Salary Basis must be 'fixed' or 'working_days'.")
+        pt_month = str(row.get("pt_override_month") or "").strip().lower()
+        if pt_month and pt_month not in [m.lower() for m in calendar.month_name[1:]]:
+            errors.append(f"Row {i}: PT Override Month must be a full month name (e.g. February) or blank.")
+    return errors
+
+def load_payroll_rules(version=None):
+    if version is None:
+        versions = get_payroll_rule_versions()
+        version = versions[0] if versions else DEFAULT_PAYROLL_RULE["version"]
+    rules_df = pd.DataFrame(list(db.payroll_rules.find({"version": version}, {"_id": 0})))
+    if rules_df.empty:
+        rules_df = pd.DataFrame([DEFAULT_PAYROLL_RULE])
+    for field, default in DEFAULT_PAYROLL_RULE.items():
+        if field not in rules_df.columns:
+            rules_df[field] = default
+        rules_df[field] = rules_df[field].fillna(default)
+    for field in PAYROLL_NUMERIC_FIELDS:
+        rules_df[field] = pd.to_numeric(rules_df[field], errors='coerce').fillna(DEFAULT_PAYROLL_RULE[field])
+    rules_df['effective_from'] = rules_df['effective_from'].astype(str)
+    return rules_df[PAYROLL_RULE_FIELDS]
+
+def resolve_payroll_rules(employees_df, rules_df, as_of):
+    # Attach one rule row to every employee: role/branch must match (or be "*"),
+    # the most specific match wins, then the latest effective_from.
+    rules = rules_df[rules_df['effective_from'] <= as_of]
+    if rules.empty:
+        rules = pd.DataFrame([DEFAULT_PAYROLL_RULE])
+    rules = rules.drop(columns=['version']).rename(columns={"role": "rule_role", "branch": "rule_branch"})
+
+    candidates = employees_df[['name', 'role', 'branch']].merge(rules, how='cross')
+    candidates = candidates[
+        (candidates['rule_role'] == "*") | (candidates['rule_role'] == candidates['role'])
+    ]
+    candidates = candidates[
+        (candidates['rule_branch'] == "*") | (candidates['rule_branch'] == candidates['branch'])
+    ]
+    candidates = candidates.assign(
+        specificity=(candidates['rule_role'] != "*").astype(int) * 2 + (candidates['rule_branch'] != "*").astype(int)
+    )
+    best = candidates.sort_values(['specificity', 'effective_from'], ascending=False).drop_duplicates('name')
+    best = best.drop(columns=['role', 'branch', 'rule_role', 'rule_branch', 'specificity'])
+
+    resolved = employees_df.merge(best, on='name', how='left')
+    for field in PAYROLL_RULE_FIELDS:
+        if field in resolved.columns:
+            resolved[field] = resolved[field].fillna(DEFAULT_PAYROLL_RULE[field])
+    return resolved
+
+def compile_payroll_rules(month_name):
+    # Each entry is a column expression over the whole frame; DataFrame.assign
+    # evaluates them in order, so later expressions can use earlier columns.
+    month_key = str(month_name).strip().lower()
+    return {
+        "fixed_days_in_month": lambda f: f['fixed_days'].where(f['salary_basis'] != "working_days", f['working_days']).astype(float),
+        "pt_deduction": lambda f: f['pt_amount'].where(
+            f['pt_override_month'].astype(str).str.strip().str.lower() != month_key, f['pt_override_amount']
+        ).astype(float),
+        "per_day_salary": lambda f: (f['monthly_salary'] / f['fixed_days_in_month']).round(2),
+        "per_day_sd": lambda f: (f['security_deposit'] / f['fixed_days_in_month']).round(2),
+        "earned_salary": lambda f: (f['per_day_salary'] * f['days_present']).round(2),
+        "earned_sd": lambda f: (f['per_day_sd'] * f['days_present']).round(2),
+        "total_earned": lambda f: (f['earned_salary'] + f['earned_sd']).round(2),
+        "ot_pay": lambda f: (f['ot_hours'] * f['ot_rate']).round(2),
+        "final_salary": lambda f: (f['total_earned'] - f['pt_deduction'] + f['ot_pay']).round(2),
+        "earn_gross": lambda f: (f['earned_salary'] + f['ot_pay'] + f['earned_sd']).round(2),
+        "absent_days": lambda f: (f['fixed_days_in_month'] - f['days_present']).clip(lower=0)
+    }
+
+def evaluate_payroll(employees_df, month_name, as_of, rules_df=None):
+    if rules_df is None:
+        rules_df = load_payroll_rules()
+    resolved = resolve_payroll_rules(employees_df, rules_df, as_of)
+    return resolved.assign(**compile_payroll_rules(month_name))
+
+def summarize_attendance(attendance_df, users_df):
+    names = users_df['name']
+    if attendance_df.empty:
+        return pd.DataFrame({"name": names, "days_present": 0, "ot_hours": 0.0})
+
+    att = attendance_df.copy()
+    for col in ['check_in', 'work_hours', 'ot_hours']:
+        if col not in att.columns:
+            att[col] = "" if col == 'check_in' else 0.0
+    work = pd.to_numeric(att['work_hours'], errors='coerce').fillna(0.0).abs()
+    stored_ot = pd.to_numeric(att['ot_hours'], errors='coerce').fillna(0.0).abs()
+    std = att['name'].map(users_df.set_index('name')['standard_hours']).fillna(8.0)
+    att['ot_final'] = (work - std).where(work > std, stored_ot)
+
+    present = att['check_in'].notna() & (att['check_in'] != '')
+    days_present = att[present].groupby('name')['date_val'].nunique()
+    ot_hours = att.groupby('name')['ot_final'].sum()
+    return pd.DataFrame({
+        "name": names,
+        "days_present": names.map(days_present).fillna(0).astype(int),
+        "ot_hours": names.map(ot_hours).fillna(0.0)
+    })
+
+def compute_month_payroll(target_month, target_year, rules_df=None, attendance_df=None):
+    users_df = pd.DataFrame(list(db.users.find({}, {
+        "_id": 0, "name": 1, "role": 1, "branch": 1, "monthly_salary": 1,
+        "working_days": 1, "standard_hours": 1, "security_deposit": 1
+    })))
+    if users_df.empty:
+        return users_df
+    user_defaults = {"role": "staff", "branch": "", "monthly_salary": 18000.0, "working_days": 26, "standard_hours": 8.0, "security_deposit": 0.0}
+    for field, default in user_defaults.items():
+        if field not in users_df.columns:
+            users_df[field] = default
+        users_df[field] = users_df[field].fillna(default)
+
+    if attendance_df is None:
+        attendance_df = pd.DataFrame(list(db.attendance.find(
+            {"month_val": target_month, "year_val": target_year},
+            {"_id": 0, "name": 1, "date_val": 1, "check_in": 1, "work_hours": 1, "ot_hours": 1}
+        )))
+    employees_df = users_df.merge(summarize_attendance(attendance_df, users_df), on='name', how='left')
+    # Like the per-employee dashboard, nobody without attendance is paid or taxed
+    employees_df = employees_df[employees_df['days_present'] > 0].reset_index(drop=True)
+    if employees_df.empty:
+        return employees_df
+
+    month_index = list(calendar.month_name).index(target_month)
+    as_of = f"{target_year}-{month_index:02d}-01"
+    payroll = evaluate_payroll(employees_df, target_month, as_of, rules_df)
+
+    # Same guard as the per-employee dashboard; flagged rows must not be paid
+    invalid = (
+        (pd.to_numeric(payroll['working_days'], errors='coerce').fillna(0) <= 0)
+        | (pd.to_numeric(payroll['standard_hours'], errors='coerce').fillna(0) <= 0)
+        | (payroll['fixed_days_in_month'].fillna(0) <= 0)
+    )
+    payroll['payroll_error'] = ""
+    payroll.loc[invalid, 'payroll_error'] = "Working Days and Standard Hours must be greater than 0."
+    return payroll
+
+# Attendance change log: every punch or HR edit is appended to attendance_events
+# right after it is applied. attendance_snapshots holds the full state of a month
+# at a given event seq, so any point in time is rebuilt from the nearest snapshot
+# plus the events after it.
+SNAPSHOT_EVERY = 200
+
+def next_event_seq():
+    counter = db.counters.find_one_and_update(
+        {"_id": "attendance_events"},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=pymongo.ReturnDocument.AFTER
+    )
+    return counter["seq"]
+
+def current_event_seq():
+    counter = db.counters.find_one({"_id": "attendance_events"})
+    return counter["seq"] if counter else 0
+
+def to_utc_naive(moment):
+    # pymongo stores and returns naive UTC datetimes
+    if moment.tzinfo is None:
+        return moment
+    return moment.astimezone(pytz.utc).replace(tzinfo=None)
+
+def replay_attendance(month_val, year_val, as_of=None):
+    snapshot_query = {"month_val": month_val, "year_val": year_val}
+    if as_of is not None:
+        snapshot_query["taken_at"] = {"$lte": to_utc_naive(as_of)}
+    snapshot = db.attendance_snapshots.find_one(snapshot_query, sort=[("seq", -1)])
+    if snapshot is None:
+        if as_of is not None:
+            return None
+        return pd.DataFrame(list(db.attendance.find({"month_val": month_val, "year_val": year_val}, {"_id": 0})))
+
+    state = {(row["name"], row["date_val"]): dict(row) for row in snapshot["rows"]}
+    event_query = {"month_val": month_val, "year_val": year_val, "seq": {"$gt": snapshot["seq"]}}
+    if as_of is not None:
+        event_query["ts"] = {"$lte": to_utc_naive(as_of)}
+    for event in db.attendance_events.find(event_query).sort("seq", 1):
+        if event["action"] == "recompute":
+            for row in state.values():
+                if row["name"] == event["name"] and event["date_val"] <= row["date_val"] <= event["fields"]["date_to"]:
+                    row.update(compute_hours_fields(row.get("check_in"), row.get("check_out"), event["fields"]["standard_hours"]))
+            continue
+        row = state.setdefault((event["name"], event["date_val"]), {
+            "name": event["name"],
+            "date_val": event["date_val"],
+            "month_val": month_val,
+            "year_val": year_val
+        })
+        row.update(event["fields"])
+    return pd.DataFrame(list(state.values()))
+
+def take_attendance_snapshot(month_val, year_val):
+    # Always snapshot from the attendance collection, reading the seq first.
+    # Writes happen before their event takes a seq, so any event with
+    # seq <= this one is already visible in the rows read below; later events
+    # are replayed on top, which is harmless as they only $set fields.
+    seq = current_event_seq()
+    state_df = pd.DataFrame(list(db.attendance.find({"month_val": month_val, "year_val": year_val}, {"_id": 0})))
+    db.attendance_snapshots.insert_one({
+        "month_val": month_val,
+        "year_val": year_val,
+        "seq": seq,
+        "taken_at": datetime.now(pytz.utc),
+        "rows": state_df.astype(object).where(state_df.notna(), None).to_dict("records")
+    })
+
+def log_attendance_event(action, name, date_val, fields, actor=""):
+    record_date = datetime.strptime(date_val, "%Y-%m-%d")
+    month_val = record_date.strftime("%B")
+    year_val = record_date.strftime("%Y")
+    # Per-month count of events since that month's last snapshot
+    month_counter = db.counters.find_one_and_update(
+        {"_id": f"attendance_events:{year_val}-{month_val}"},
+        {"$inc": {"since_snapshot": 1}},
+        upsert=True,
+        return_document=pymongo.ReturnDocument.AFTER
+    )
+    since_snapshot = month_counter["since_snapshot"]
+    if since_snapshot == 1 and db.attendance_snapshots.count_documents({"month_val": month_val, "year_val": year_val}, limit=1) == 0:
+        # Baseline the month on its first logged change
+        take_attendance_snapshot(month_val, year_val)
+
+    seq = next_event_seq()
+    db.attendance_events.insert_one({
+        "seq": seq,
+        "ts": datetime.now(pytz.utc),
+        "action": action,
+        "actor": actor,
+        "name": name,
+        "date_val": date_val,
+        "month_val": month_val,
+        "year_val": year_val,
+        "fields": fields
+    })
+    if since_snapshot >= SNAPSHOT_EVERY:
+        # Conditional reset: only the caller that wins it takes the snapshot
+        claimed = db.counters.update_one(
+            {"_id": f"attendance_events:{year_val}-{month_val}", "since_snapshot": {"$gte": SNAPSHOT_EVERY}},
+            {"$inc": {"since_snapshot": -SNAPSHOT_EVERY}}
+        )
+        if claimed.modified_count == 1:
+            take_attendance_snapshot(month_val, year_val)
+
+def get_standard_hours(name):
+    user = db.users.find_one({"name": name}, {"standard_hours": 1})
+    return float((user or {}).get("standard_hours") or 8.0)
+
+# Server-side mirror of compute_hours_fields for update-with-aggregation-pipeline:
+# derived hours are recomputed inside MongoDB without pulling documents back.
+# Matches exactly what strptime("%H:%M:%S") accepts, including one-digit fields.
+TIME_PATTERN = "^([01]?[0-9]|2[0-3]):[0-5]?[0-9]:[0-5]?[0-9]$"
+
+def seconds_since_midnight(field):
+    parts = {"$split": [f"${field}", ":"]}
+    return {"$add": [
+        {"$multiply": [{"$toInt": {"$arrayElemAt": [parts, 0]}}, 3600]},
+        {"$multiply": [{"$toInt": {"$arrayElemAt": [parts, 1]}}, 60]},
+        {"$toInt": {"$arrayElemAt": [parts, 2]}}
+    ]}
+
+def attendance_hours_pipeline(standard_hours):
+    valid_times = {"$and": [
+        {"$regexMatch": {"input": {"$toString": {"$ifNull": [f"${field}", ""]}}, "regex": TIME_PATTERN}}
+        for field in ["check_in", "check_out"]
+    ]}
+    raw_hours = {"$divide": [{"$subtract": [seconds_since_midnight("check_out"), seconds_since_midnight("check_in")]}, 3600.0]}
+    return [
+        {"$set": {"work_hours": {"$cond": [
+            valid_times,
+            {"$let": {
+                "vars": {"hours": raw_hours},
+                "in": {"$cond": [{"$lt": ["$$hours", 0]}, {"$add": ["$$hours", 24.0]}, "$$hours"]}
+            }},
+            0.0
+        ]}}},
+        {"$set": {"ot_hours": {"$max": [{"$subtract": ["$work_hours", standard_hours]}, 0.0]}}}
+    ]
+
+def recompute_attendance_hours(names, start_date, end_date, progress=None):
+    # One update_many per (standard_hours group, month): each chunk is logged,
+    # then recomputed entirely on the server.
+    users = list(db.users.find({"name": {"$in": list(names)}}, {"_id": 0, "name": 1, "standard_hours": 1}))
+    groups = {}
+    for user in users:
+        groups.setdefault(float(user.get("standard_hours") or 8.0), []).append(user["name"])
+
+    months = pd.period_range(start_date[:7], end_date[:7], freq="M")
+    chunks = [(std, group, month) for std, group in groups.items() for month in months]
+    modified = 0
+    for done, (std, group, month) in enumerate(chunks, start=1):
+        month_start = max(start_date, month.start_time.strftime("%Y-%m-%d"))
+        month_end = min(end_date, month.end_time.strftime("%Y-%m-%d"))
+        query = {"name": {"$in": group}, "date_val": {"$gte": month_start, "$lte": month_end}}
+        affected_names = db.attendance.distinct("name", query)
+        result = db.attendance.update_many(query, attendance_hours_pipeline(std))
+        modified += result.modified_count
+        for name in affected_names:
+            log_attendance_event("recompute", name, month_start, {"standard_hours": std, "date_to": month_end}, actor=st.session_state.get("hr_name", ""))
+        if progress:
+            progress(done, len(chunks))
+    return modified
+
+def attendance_date_bounds(names):
+    query = {"name": {"$in": list(names)}, "date_val": {"$regex": "^[0-9]{4}-[0-9]{2}-[0-9]{2}$"}}
+    first = db.attendance.find_one(query, {"date_val": 1}, sort=[("date_val", 1)])
+    last = db.attendance.find_one(query, {"date_val": 1}, sort=[("date_val", -1)])
+    if not first:
+        return None, None
+    return first["date_val"], last["date_val"]
+
+def run_recompute_with_progress(names, start_date=None, end_date=None):
+    if start_date is None or end_date is None:
+        start_date, end_date = attendance_date_bounds(names)
+        if start_date is None:
+            return 0
+    progress_bar = st.progress(0.0, text="Recomputing attendance hours...")
+    modified = recompute_attendance_hours(
+        names, start_date, end_date,
+        progress=lambda done, total: progress_bar.progress(done / total, text=f"Recomputing attendance hours... {done}/{total} chunks")
+    )
+    progress_bar.empty()
+    return modified
+
 # ==========================================
 # 2. Page Configuration & Setup
 # ==========================================
@@ -165,10 +543,21 @@ with tab_staff:
                         "date_val": {"$ne": date_val}
                     })
                     for shift in open_shifts:
+                        auto_fields = dict(
+                            compute_hours_fields(shift.get("check_in"), "18:30:00", get_standard_hours(employee_name)),
+                            check_out="18:30:00", remark="Auto-checkout (Forgot)"
+                        )
                         db.attendance.update_one(
                             {"_id": shift["_id"]}, 
-                            {"$set": {"check_out": "18:30:00", "remark": "Auto-checkout (Forgot)"}}
+                            {"$set": auto_fields}
                         )
+                        try:
+                            shift_date = datetime.strptime(str(shift.get("date_val", "")), "%Y-%m-%d").strftime("%Y-%m-%d")
+                        except:
+                            shift_date = ""
+                        
+                        if shift_date:
+                            log_attendance_event("auto_checkout", employee_name, shift_date, auto_fields)
                     
                     today_shift = db.attendance.find_one({"name": employee_name, "date_val": date_val})
                     
@@ -188,7 +577,9 @@ with tab_staff:
                             "remark": "",
                             "absent": "No"
                         }
+                        checkin_fields = {k: v for k, v in doc.items() if k not in ("name", "date_val", "month_val", "year_val")}
                         db.attendance.insert_one(doc)
+                        log_attendance_event("check_in", employee_name, date_val, checkin_fields)
                         st.success(f"{employee_name} checked in successfully at {current_time}! Please remember to check out.")
 
         with col_btn2:
@@ -211,28 +602,21 @@ with tab_staff:
                     else:
                         doc_id = today_shift["_id"]
                         check_in_time_str = today_shift.get("check_in", "")
-                        
-                        fmt = "%H:%M:%S"
-                        try:
-                            t1 = datetime.strptime(check_in_time_str, fmt)
-                            t2 = datetime.strptime(current_time, fmt)
-                            tdelta = t2 - t1
-                            work_hours = tdelta.total_seconds() / 3600.0
-                            if work_hours < 0:
-                                work_hours += 24.0 
-                        except:
-                            work_hours = 0.0
+                        hours_fields = compute_hours_fields(check_in_time_str, current_time, get_standard_hours(employee_name))
+                        work_hours = hours_fields["work_hours"]
                             
+                        checkout_fields = dict(hours_fields, check_out=current_time)
                         db.attendance.update_one(
                             {"_id": doc_id},
-                            {"$set": {"check_out": current_time, "work_hours": work_hours}}
+                            {"$set": checkout_fields}
                         )
+                        log_attendance_event("check_out", employee_name, date_val, checkout_fields)
                         st.success(f"{employee_name} checked out successfully at {current_time}! Work Hours Logged: {work_hours:.2f} hrs.")
 
 # ==========================================
 # 4. Shared Salary Processing Function
 # ==========================================
-def render_salary_dashboard(df, target_employee, monthly_salary, working_days, standard_hours_per_day, security_deposit=0.0):
+def render_salary_dashboard(df, target_employee, monthly_salary, working_days, standard_hours_per_day, security_deposit=0.0, role="staff", branch="", payroll_month=None, as_of=None):
     if df.empty:
         st.info(f"No attendance records found to process.")
         return
@@ -261,12 +645,8 @@ def render_salary_dashboard(df, target_employee, monthly_salary, working_days, s
     df['Parsed_Work_Hrs'] = df[working_col].apply(parse_hours).abs()
     df['Parsed_OT_Hrs'] = df[ot_col].apply(parse_hours).abs()
     
-    def compute_ot(row):
-        if row['Parsed_Work_Hrs'] > standard_hours_per_day:
-            return row['Parsed_Work_Hrs'] - standard_hours_per_day
-        return row['Parsed_OT_Hrs'] 
-    
-    df['Parsed_OT_Hrs'] = df.apply(compute_ot, axis=1)
+    over_standard = df['Parsed_Work_Hrs'] > standard_hours_per_day
+    df['Parsed_OT_Hrs'] = (df['Parsed_Work_Hrs'] - standard_hours_per_day).where(over_standard, df['Parsed_OT_Hrs'])
 
     actual_worked_hours = df['Parsed_Work_Hrs'].sum()
     total_ot_hours = df['Parsed_OT_Hrs'].sum()
@@ -275,33 +655,35 @@ def render_salary_dashboard(df, target_employee, monthly_salary, working_days, s
         st.error("Working Days and Standard Hours must be greater than 0.")
         return
         
-    # 30-Day Fixed Salary Math with 2-Decimal Precision
-    per_day_salary = round(monthly_salary / 30.0, 2)
-    per_day_sd = round(security_deposit / 30.0, 2)
-    
     # Calculate days present (count based on check-in existence rather than parseable hours)
     if 'check_in' in df.columns:
         days_present = df[df['check_in'].notna() & (df['check_in'] != '')]['date_val'].nunique()
     else:
         days_present = df['date_val'].nunique()
     
-    # Calculate Earned Proportions
-    earned_salary = round(per_day_salary * days_present, 2)
-    earned_sd = round(per_day_sd * days_present, 2)
-    total_earned = round(earned_salary + earned_sd, 2)
-        
-    # Professional Tax (PT) Calculation
-    # PT is 200 every month, except February where it is 300
-    pt_deduction = 0.0
-    if not df.empty:
-        first_month_recorded = df['month_val'].iloc[0].strip().lower()
-        if first_month_recorded == "february":
-            pt_deduction = 300.0
-        else:
-            pt_deduction = 200.0
-        
-    ot_pay = round(total_ot_hours * 50.0, 2)
-    final_salary = round(total_earned - pt_deduction + ot_pay, 2)
+    # Salary, PT and OT come from the payroll rules table (see "Payroll Rules" tab)
+    if payroll_month is None:
+        payroll_month = str(df['month_val'].iloc[0]) if 'month_val' in df.columns else datetime.now().strftime("%B")
+    if as_of is None:
+        as_of = datetime.now().strftime("%Y-%m-%d")
+    employee_df = pd.DataFrame([{
+        "name": target_employee,
+        "role": role,
+        "branch": branch,
+        "monthly_salary": monthly_salary,
+        "working_days": working_days,
+        "security_deposit": security_deposit,
+        "days_present": days_present,
+        "ot_hours": total_ot_hours
+    }])
+    payroll = evaluate_payroll(employee_df, payroll_month, as_of).iloc[0]
+    
+    fixed_days_in_month = payroll['fixed_days_in_month']
+    earned_salary = payroll['earned_salary']
+    earned_sd = payroll['earned_sd']
+    pt_deduction = payroll['pt_deduction']
+    ot_pay = payroll['ot_pay']
+    final_salary = payroll['final_salary']
     
     # UI Card Wrapper for Metrics
     with st.container(border=True):
@@ -354,13 +736,13 @@ def render_salary_dashboard(df, target_employee, monthly_salary, working_days, s
     with pd.ExcelWriter(output, engine='openpyxl') as writer:
         df_export.to_excel(writer, index=False, sheet_name='Timesheet')
         # Calculate absent days for the export
-        absent_days = max(0, 30 - days_present)
+        absent_days = int(payroll['absent_days'])
         
         # Fine/Security with KINI = earned_sd (the SD component earned for present days)
         fine_security_kini = earned_sd
         
         # Earn Gross = Earned Salary + OT + Fine/Security
-        earn_gross = round(earned_salary + ot_pay + fine_security_kini, 2)
+        earn_gross = payroll['earn_gross']
         
         # Total Deduction = Absent penalty (absent_days * per_day_salary) + PT
         total_deduction = round(pt_deduction, 2)
@@ -372,7 +754,7 @@ def render_salary_dashboard(df, target_employee, monthly_salary, working_days, s
             "Sr No": 1,
             "Employee Name": target_employee,
             "Male/ Female": "",
-            "Fixed days in Month": 30,
+            "Fixed days in Month": int(fixed_days_in_month),
             "Paid Pay": days_present,
             "Fixed Salary": monthly_salary,
             "Basic": monthly_salary,
@@ -443,7 +825,7 @@ with tab_hr:
         st.sidebar.divider()
         st.header(":material/dashboard: HR Management Dashboard")
 
-        hr_sub_tabs = st.tabs([":material/analytics: Salary Calculations", ":material/groups: Staff Management", ":material/folder_open: Manual Overrides"])
+        hr_sub_tabs = st.tabs([":material/analytics: Salary Calculations", ":material/groups: Staff Management", ":material/folder_open: Manual Overrides", ":material/rule: Payroll Rules"])
         
         with hr_sub_tabs[0]:
             st.subheader("Live Employee Calculations")
@@ -508,36 +890,34 @@ with tab_hr:
                 from bson.objectid import ObjectId
                 from datetime import datetime as dt
                 
-                for index, row in edited_df.iterrows():
+                # Only rows that differ from what was loaded are written and logged
+                aligned = check1.reindex(check2.index)
+                changed_rows = (aligned != check2).any(axis=1)
+                
+                standard_hours = get_standard_hours(target_employee)
+                
+                for index, row in edited_df[changed_rows].iterrows():
                     db_id = str(row.get('_id', '')).strip() if pd.notna(row.get('_id')) else ""
                     new_ci = str(row.get('check_in', '')).strip() if pd.notna(row.get('check_in')) else ""
                     new_co = str(row.get('check_out', '')).strip() if pd.notna(row.get('check_out')) else ""
                     new_remark = str(row.get('remark', '')).strip() if pd.notna(row.get('remark')) else ""
                     date_val = str(row['date_val'])
                     
-                    work_hours = 0.0
-                    if new_ci != "" and new_co != "":
-                        fmt = "%H:%M:%S"
-                        try:
-                            t1 = datetime.strptime(new_ci, fmt)
-                            t2 = datetime.strptime(new_co, fmt)
-                            tdelta = t2 - t1
-                            work_hours = tdelta.total_seconds() / 3600.0
-                            if work_hours < 0:
-                                work_hours += 24.0
-                        except:
-                            work_hours = 0.0
+                    hours_fields = compute_hours_fields(new_ci, new_co, standard_hours)
                             
+                    edit_fields = {
+                        "check_in": new_ci, 
+                        "check_out": new_co, 
+                        "work_hours": hours_fields["work_hours"], 
+                        "ot_hours": hours_fields["ot_hours"], 
+                        "remark": new_remark
+                    }
                     if db_id and db_id.lower() != 'nan':
                         db.attendance.update_one(
                             {"_id": ObjectId(db_id)},
-                            {"$set": {
-                                "check_in": new_ci, 
-                                "check_out": new_co, 
-                                "work_hours": work_hours, 
-                                "remark": new_remark
-                            }}
+                            {"$set": edit_fields}
                         )
+                        log_attendance_event("edit", target_employee, date_val, edit_fields, actor=st.session_state.hr_name)
                     elif new_ci or new_co or new_remark:
                         try:
                             day_name = dt.strptime(date_val, "%Y-%m-%d").strftime("%A")
@@ -552,9 +932,15 @@ with tab_hr:
                             "year_val": target_year,
                             "check_in": new_ci,
                             "check_out": new_co,
-                            "work_hours": work_hours,
+                            "work_hours": hours_fields["work_hours"],
+                            "ot_hours": hours_fields["ot_hours"],
                             "remark": new_remark
                         })
+                        if day_name:
+                            log_attendance_event(
+                                "edit", target_employee, date_val, dict(edit_fields, day_val=day_name),
+                                actor=st.session_state.hr_name
+                            )
                 
                 st.toast("Timesheet Auto-Saved!")
                 st.rerun()
@@ -576,7 +962,11 @@ with tab_hr:
             standard_hours_per_day = float(user_vars.get("standard_hours", 8.0))
             security_deposit = float(user_vars.get("security_deposit", 0.0))
             
-            render_salary_dashboard(full_df, target_employee, monthly_salary, working_days, standard_hours_per_day, security_deposit)
+            render_salary_dashboard(
+                full_df, target_employee, monthly_salary, working_days, standard_hours_per_day, security_deposit,
+                role=user_vars.get("role", "staff"), branch=user_vars.get("branch", ""),
+                payroll_month=target_month, as_of=f"{target_year}-{month_index:02d}-01"
+            )
 
         with hr_sub_tabs[1]:
             st.subheader("Manage Staff & PINs")
@@ -601,12 +991,17 @@ with tab_hr:
                         {"$set": {
                             "pin": row['pin'], 
                             "role": row['role'], 
+                            "branch": str(row['branch']).strip(), 
                             "monthly_salary": float(row['monthly_salary']), 
                             "working_days": int(row['working_days']), 
                             "standard_hours": float(row['standard_hours']), 
                             "security_deposit": float(row['security_deposit'])
                         }}
                     )
+                hours_changed = users_df['standard_hours'].astype(str) != edited_users['standard_hours'].astype(str)
+                if hours_changed.any():
+                    modified = run_recompute_with_progress(edited_users.loc[hours_changed, 'name'].tolist())
+                    st.toast(f"Recomputed hours on {modified} attendance records.")
                 st.toast("Staff table auto-saved!")
                 st.rerun()
             
@@ -617,6 +1012,8 @@ with tab_hr:
                     with col_f2: new_pin = st.text_input("PIN (4 digits)", max_chars=4)
                     with col_f3: new_role = st.selectbox("Role", ["staff", "hr"])
                     
+                    new_branch = st.text_input("Branch", help="Used to match branch-specific payroll rules.")
+                    
                     col_v1, col_v2 = st.columns(2)
                     with col_v1: new_salary = st.number_input("Monthly Salary", value=18000.0, step=1000.0)
                     with col_v2: new_days = st.number_input("Working Days", value=26)
@@ -638,15 +1035,17 @@ with tab_hr:
                                 db.users.update_one(
                                     {"name": new_name},
                                     {"$set": {
-                                        "pin": new_pin, "role": new_role, 
+                                        "pin": new_pin, "role": new_role, "branch": new_branch.strip(), 
                                         "monthly_salary": new_salary, "working_days": new_days, 
                                         "standard_hours": new_hrs, "security_deposit": new_sd
                                     }}
                                 )
+                                if float(ext.get("standard_hours", 8.0)) != float(new_hrs):
+                                    run_recompute_with_progress([new_name])
                                 st.success(f"Updated {new_name}'s Profile Settings.")
                             else:
                                 db.users.insert_one({
-                                    "name": new_name, "pin": new_pin, "role": new_role, 
+                                    "name": new_name, "pin": new_pin, "role": new_role, "branch": new_branch.strip(), 
                                     "monthly_salary": new_salary, "working_days": new_days, 
                                     "standard_hours": new_hrs, "security_deposit": new_sd
                                 })
@@ -665,6 +1064,27 @@ with tab_hr:
                             st.success(f"Removed user {del_name}")
                             st.rerun()
 
+            with st.expander("Recompute Attendance Hours"):
+                st.markdown("Refresh stored Work Hours and OT from Check In/Out using each employee's current Standard Hrs/Day.")
+                with st.form("recompute_hours_form"):
+                    recompute_names = st.multiselect("Employees", staff_names, default=staff_names)
+                    ist = pytz.timezone('Asia/Kolkata')
+                    today = datetime.now(ist).date()
+                    recompute_range = st.date_input("Date Range", value=(today.replace(month=1, day=1), today))
+                    recompute_submit = st.form_submit_button("Recompute")
+                    if recompute_submit:
+                        if not recompute_names:
+                            st.error("Select at least one employee.")
+                        elif len(recompute_range) != 2:
+                            st.error("Select both a start and an end date.")
+                        else:
+                            modified = run_recompute_with_progress(
+                                recompute_names,
+                                recompute_range[0].strftime("%Y-%m-%d"),
+                                recompute_range[1].strftime("%Y-%m-%d")
+                            )
+                            st.success(f"Recomputed hours on {modified} attendance records.")
+
         with hr_sub_tabs[2]:
             st.subheader("Manual Timesheet Override")
             st.markdown("Run calculations securely on external files without updating the live database.")
@@ -679,3 +1099,97 @@ with tab_hr:
                     render_salary_dashboard(man_df, "External User", 18000.0, 26, 8.0, 0.0)
                 except Exception as e:
                     st.error(f"Error reading file format: {e}")
+
+        with hr_sub_tabs[3]:
+            st.subheader("Payroll Rules")
+            st.markdown("Rules are versioned. Edit a version below and publish it as a new version; older versions stay available for re-runs.")
+            
+            rule_versions = get_payroll_rule_versions() or [DEFAULT_PAYROLL_RULE["version"]]
+            rule_version = st.selectbox("Rule Version", rule_versions, format_func=lambda v: f"v{v}", key="rule_version_select")
+            rules_df = load_payroll_rules(rule_version)
+            
+            edited_rules = st.data_editor(
+                rules_df.drop(columns=["version"]),
+                column_config={
+                    "role": st.column_config.TextColumn("Role (* = all)"),
+                    "branch": st.column_config.TextColumn("Branch (* = all)"),
+                    "effective_from": st.column_config.TextColumn("Effective From (YYYY-MM-DD)"),
+                    "salary_basis": st.column_config.SelectboxColumn("Salary Basis", options=["fixed", "working_days"]),
+                    "fixed_days": st.column_config.NumberColumn("Fixed Days"),
+                    "pt_amount": st.column_config.NumberColumn("PT"),
+                    "pt_override_month": st.column_config.TextColumn("PT Override Month"),
+                    "pt_override_amount": st.column_config.NumberColumn("PT Override"),
+                    "ot_rate": st.column_config.NumberColumn("OT Rate / Hr")
+                },
+                hide_index=True,
+                num_rows="dynamic",
+                use_container_width=True,
+                key="payroll_rules_editor"
+            )
+            
+            if st.button(":material/publish: Publish as New Version", type="primary"):
+                new_rules = edited_rules.dropna(how="all").fillna(
+                    {k: v for k, v in DEFAULT_PAYROLL_RULE.items() if k != "version"}
+                )
+                rule_errors = validate_payroll_rules(new_rules)
+                if new_rules.empty:
+                    st.error("A rule version needs at least one row.")
+                elif rule_errors:
+                    for rule_error in rule_errors:
+                        st.error(rule_error)
+                else:
+                    new_version = next_payroll_rule_version()
+                    docs = new_rules.assign(version=new_version).to_dict("records")
+                    db.payroll_rules.insert_many(docs)
+                    st.success(f"Published payroll rules v{new_version}.")
+                    st.rerun()
+            
+            st.markdown("#### Bulk Payroll Run")
+            st.markdown("Evaluate every employee for a month under the selected rule version.")
+            ist = pytz.timezone('Asia/Kolkata')
+            months = list(calendar.month_name)[1:]
+            col_r1, col_r2 = st.columns(2)
+            with col_r1:
+                run_month = st.selectbox("Month", months, index=months.index(datetime.now(ist).strftime("%B")), key="run_month_select")
+            with col_r2:
+                years = [str(y) for y in range(2024, 2030)]
+                curr_year = datetime.now(ist).strftime("%Y")
+                run_year = st.selectbox("Year", years, index=years.index(curr_year) if curr_year in years else 1, key="run_year_select")
+            
+            use_as_of = st.checkbox("Rebuild attendance as it was on a past date", key="run_as_of_toggle")
+            as_of_date = None
+            if use_as_of:
+                as_of_date = st.date_input("As of", value=datetime.now(ist).date(), key="run_as_of_date")
+            
+            # Heavy month-wide reads only happen on demand, not on every HR rerun
+            run_key = (run_month, run_year, rule_version, str(as_of_date))
+            if st.button(":material/play_arrow: Run Payroll", key="run_payroll_button"):
+                attendance_as_of = None
+                if use_as_of:
+                    as_of_moment = ist.localize(datetime.combine(as_of_date, datetime.max.time()))
+                    attendance_as_of = replay_attendance(run_month, run_year, as_of_moment)
+                if use_as_of and attendance_as_of is None:
+                    run_df = None
+                else:
+                    run_df = compute_month_payroll(run_month, run_year, rules_df, attendance_as_of)
+                st.session_state.payroll_run = {"key": run_key, "df": run_df}
+            
+            payroll_run = st.session_state.get("payroll_run")
+            if payroll_run and payroll_run["key"] == run_key:
+                run_df = payroll_run["df"]
+                if run_df is None:
+                    st.info("No attendance history was recorded for this month on or before that date.")
+                elif run_df.empty:
+                    st.info("No attendance records found for this month.")
+                else:
+                    flagged_df = run_df[run_df['payroll_error'] != ""]
+                    payable_df = run_df[run_df['payroll_error'] == ""]
+                    if not flagged_df.empty:
+                        st.warning(f"Skipped {', '.join(flagged_df['name'])}: Working Days and Standard Hours must be greater than 0.")
+                    if not payable_df.empty:
+                        st.dataframe(
+                            payable_df[["name", "role", "days_present", "ot_hours", "earned_salary", "earned_sd", "pt_deduction", "ot_pay", "final_salary"]],
+                            hide_index=True,
+                            use_container_width=True
+                        )
+                        st.metric("Total Net Payable", f"₹ {payable_df['final_salary'].sum():,.2f}")
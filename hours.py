@@ -0,0 +1,24 @@
+from datetime import datetime
+
+# Shared by app.py and load_test.py so every writer derives hours the same way.
+
+def compute_work_hours(check_in, check_out):
+    if not check_in or not check_out:
+        return 0.0
+    fmt = "%H:%M:%S"
+    try:
+        t1 = datetime.strptime(str(check_in), fmt)
+        t2 = datetime.strptime(str(check_out), fmt)
+        tdelta = t2 - t1
+        work_hours = tdelta.total_seconds() / 3600.0
+        if work_hours < 0:
+            work_hours += 24.0
+    except:
+        work_hours = 0.0
+    return work_hours
+
+def compute_hours_fields(check_in, check_out, standard_hours):
+    # Every writer of work_hours stores ot_hours alongside it, so a stale OT
+    # value can never outlive a shortened shift.
+    work_hours = compute_work_hours(check_in, check_out)
+    return {"work_hours": work_hours, "ot_hours": max(work_hours - standard_hours, 0.0)}
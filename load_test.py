@@ -0,0 +1,244 @@
+"""Concurrent-session load test for app.py using Streamlit's AppTest.
+
+Drives N kiosk sessions (check in / check out, each for its own seeded
+"Load Test Kiosk" employee) and M HR sessions (login, switch employees,
+edit timesheets) against a *local* MongoDB, then reports throughput, rerun
+latency percentiles and Mongo command counts per scenario. The harness's own
+setup and stand-in commands are tagged and reported separately.
+
+    python load_test.py --kiosks 20 --hr 3 --iterations 5
+
+AppTest cannot drive st.data_editor, so HR timesheet edits are written
+directly to the attendance collection and the session is rerun afterwards.
+This stand-in skips the editor's change-log work (event seq counter, event
+insert and occasional month snapshots), so Mongo operation counts for HR
+edits are a lower bound.
+"""
+import argparse
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlparse
+
+import pymongo
+import pytz
+from pymongo import monitoring
+from streamlit.testing.v1 import AppTest
+
+from hours import compute_hours_fields
+
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1"}
+KIOSK_PIN = "1234"
+# Tagged on every command the harness itself sends, so it can be told apart from app traffic
+HARNESS_COMMENT = "load-test-harness"
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.harness_counts = Counter()
+
+    def started(self, event):
+        with self.lock:
+            if event.command.get("comment") == HARNESS_COMMENT:
+                self.harness_counts[event.command_name] += 1
+            else:
+                self.counts[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def reset(self):
+        with self.lock:
+            snapshot = Counter(self.counts), Counter(self.harness_counts)
+            self.counts.clear()
+            self.harness_counts.clear()
+        return snapshot
+
+
+# Must be registered before app.py creates its MongoClient.
+command_counter = CommandCounter()
+monitoring.register(command_counter)
+
+
+def new_session(mongo_uri, timeout):
+    at = AppTest.from_file("app.py", default_timeout=timeout)
+    at.secrets["MONGO_URI"] = mongo_uri
+    return at
+
+
+def timed_run(at, latencies):
+    start = time.perf_counter()
+    at.run()
+    latencies.append(time.perf_counter() - start)
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+
+
+def find_by_label(elements, text):
+    for element in elements:
+        if text in element.label:
+            return element
+    raise LookupError(f"No element labelled {text!r}")
+
+
+def seed_kiosk_users(db, count):
+    # One dedicated employee per kiosk so sessions never punch for each other
+    names = [f"Load Test Kiosk {i + 1:03d}" for i in range(count)]
+    for name in names:
+        db.users.update_one(
+            {"name": name},
+            {"$setOnInsert": {
+                "name": name, "pin": KIOSK_PIN, "role": "staff", "monthly_salary": 18000.0,
+                "working_days": 26, "standard_hours": 8.0, "security_deposit": 0.0
+            }},
+            upsert=True,
+            comment=HARNESS_COMMENT
+        )
+    return [{"name": name, "pin": KIOSK_PIN} for name in names]
+
+
+def kiosk_session(mongo_uri, timeout, user, iterations, db):
+    latencies = []
+    at = new_session(mongo_uri, timeout)
+    timed_run(at, latencies)
+    today = datetime.now(pytz.timezone('Asia/Kolkata')).strftime("%Y-%m-%d")
+    for _ in range(iterations):
+        # Clear today's punch so every cycle performs a real check-in/check-out write
+        db.attendance.delete_many({"name": user["name"], "date_val": today}, comment=HARNESS_COMMENT)
+        for label in ["Check In", "Check Out"]:
+            at.selectbox(key="staff_name_select").set_value(user["name"])
+            find_by_label(at.text_input, "Enter your PIN").input(user["pin"])
+            find_by_label(at.button, label).click()
+            timed_run(at, latencies)
+    return latencies
+
+
+def hr_session(mongo_uri, timeout, hr_user, staff_names, iterations, db):
+    latencies = []
+    at = new_session(mongo_uri, timeout)
+    timed_run(at, latencies)
+    at.selectbox(key="hr_name_select").set_value(hr_user["name"])
+    at.text_input(key="hr_pin_input").input(hr_user["pin"])
+    find_by_label(at.button, "Login as HR").click()
+    timed_run(at, latencies)
+
+    ist = pytz.timezone('Asia/Kolkata')
+    now = datetime.now(ist)
+    for _ in range(iterations):
+        target = random.choice(staff_names)
+        find_by_label(at.selectbox, "Select Employee to Calculate").set_value(target)
+        timed_run(at, latencies)
+
+        # Stand-in for a data_editor save (without change-log writes): correct one day's check-out.
+        date_val = f"{now.strftime('%Y-%m')}-{random.randint(1, now.day):02d}"
+        check_out = f"{random.randint(17, 20):02d}:{random.randint(0, 59):02d}:00"
+        standard_hours = float((db.users.find_one({"name": target}, comment=HARNESS_COMMENT) or {}).get("standard_hours") or 8.0)
+        db.attendance.update_one(
+            {"name": target, "date_val": date_val},
+            {"$set": {
+                **compute_hours_fields("09:30:00", check_out, standard_hours),
+                "check_in": "09:30:00",
+                "check_out": check_out,
+                "month_val": now.strftime("%B"),
+                "year_val": now.strftime("%Y"),
+                "remark": "Load test edit"
+            }},
+            upsert=True,
+            comment=HARNESS_COMMENT
+        )
+        timed_run(at, latencies)
+    return latencies
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_scenario(name, args, db, kiosk_users, hrs):
+    kiosks = len(kiosk_users)
+    if kiosks + hrs == 0:
+        print(f"\n=== {name}: skipped (no sessions) ===")
+        return
+
+    users = list(db.users.find({}, {"_id": 0, "name": 1, "pin": 1, "role": 1}, comment=HARNESS_COMMENT))
+    hr_users = [u for u in users if u.get("role") == "hr"]
+    staff_names = [u["name"] for u in users]
+    if hrs and not hr_users:
+        raise SystemExit("No HR user found in the database.")
+
+    command_counter.reset()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=kiosks + hrs) as pool:
+        futures = [
+            pool.submit(kiosk_session, args.mongo_uri, args.timeout, user, args.iterations, db)
+            for user in kiosk_users
+        ]
+        futures += [
+            pool.submit(hr_session, args.mongo_uri, args.timeout, hr_users[i % len(hr_users)], staff_names, args.iterations, db)
+            for i in range(hrs)
+        ]
+        latencies = []
+        errors = 0
+        for future in futures:
+            try:
+                latencies.extend(future.result())
+            except Exception as e:
+                errors += 1
+                print(f"  session failed: {e}")
+    wall = time.perf_counter() - start
+    ops, harness_ops = command_counter.reset()
+
+    latencies.sort()
+    print(f"\n=== {name}: {kiosks} kiosk / {hrs} HR sessions x {args.iterations} iterations ===")
+    print(f"Reruns: {len(latencies)}  Failed sessions: {errors}  Wall time: {wall:.2f}s")
+    print(f"Throughput: {len(latencies) / wall if wall else 0.0:.2f} reruns/s")
+    print(
+        f"Rerun latency ms  p50: {percentile(latencies, 50) * 1000:.1f}  "
+        f"p95: {percentile(latencies, 95) * 1000:.1f}  p99: {percentile(latencies, 99) * 1000:.1f}"
+    )
+    print(f"App Mongo operations: {sum(ops.values())}")
+    for command, count in ops.most_common():
+        print(f"  {command:<16} {count}")
+    print(f"Harness Mongo operations (excluded above): {sum(harness_ops.values())}")
+    for command, count in harness_ops.most_common():
+        print(f"  {command:<16} {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent AppTest load test for the salary portal.")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--kiosks", type=int, default=10, help="Concurrent kiosk punch sessions (N)")
+    parser.add_argument("--hr", type=int, default=2, help="Concurrent HR timesheet sessions (M)")
+    parser.add_argument("--iterations", type=int, default=3, help="Punch/edit cycles per session")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-rerun timeout in seconds")
+    args = parser.parse_args()
+
+    if urlparse(args.mongo_uri).hostname not in LOCAL_HOSTS:
+        raise SystemExit("Refusing to load test a non-local database.")
+
+    client = pymongo.MongoClient(args.mongo_uri)
+    db = client['kinihara_timesheet']
+
+    # Warm-up run seeds the default users and populates st.cache_resource.
+    timed_run(new_session(args.mongo_uri, args.timeout), [])
+
+    kiosk_users = seed_kiosk_users(db, args.kiosks)
+
+    run_scenario("Kiosk rush", args, db, kiosk_users, 0)
+    run_scenario("HR month-end", args, db, [], args.hr)
+    run_scenario("Mixed", args, db, kiosk_users, args.hr)
+
+
+if __name__ == "__main__":
+    main()